@@ -1,77 +1,123 @@
 """Incremental build cache management."""
 
-import json
+import os
 import hashlib
 from pathlib import Path
-from dataclasses import dataclass
+from typing import Iterable
+
+from . import jsonio
 
 CACHE_FILE = ".vcbuild_cache.json"
+CACHE_VERSION = 4
 
-@dataclass
-class CacheEntry:
-    hash: str
-    mtime: float
+def _empty_cache() -> dict:
+    return {
+        "version": CACHE_VERSION,
+        "config_hash": "",
+        "project_fp": "",
+        "dependencies": [],
+        "command_cache": {}
+    }
 
 class BuildCache:
     def __init__(self, project_root: Path):
         self.project_root = project_root
         self.cache_path = project_root / CACHE_FILE
         self.data = self._load()
+        self._dirty = False
     
     def _load(self) -> dict:
         if not self.cache_path.exists():
-            return {"version": 1, "files": {}, "config_hash": ""}
+            return _empty_cache()
         try:
-            with open(self.cache_path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
-            return {"version": 1, "files": {}, "config_hash": ""}
+            data = jsonio.loads(self.cache_path.read_bytes())
+        except (ValueError, OSError):
+            return _empty_cache()
+        if not isinstance(data, dict):
+            return _empty_cache()
+        # Entries from another version can never match
+        if data.get("version") != CACHE_VERSION:
+            return _empty_cache()
+        return data
     
     def save(self):
-        with open(self.cache_path, "w", encoding="utf-8") as f:
-            json.dump(self.data, f, indent=2)
+        """Write the cache if it was modified, replacing the file atomically."""
+        if not self._dirty:
+            return
+        tmp = self.cache_path.with_suffix(".json.tmp")
+        tmp.write_bytes(jsonio.dumps(self.data))
+        os.replace(tmp, self.cache_path)
+        self._dirty = False
     
-    def file_changed(self, path: Path) -> bool:
-        if not path.exists():
-            return True
-        
-        key = str(path.resolve())
-        current_hash = _hash_file(path)
-        
-        cached = self.data.get("files", {}).get(key)
-        if cached is None:
-            return True
-        
-        return cached.get("hash") != current_hash
+    def project_fingerprint(self, paths: list[str | Path],
+                            known: Iterable[tuple[str, int | None, int | None]] = ()
+                            ) -> str:
+        """Digest the (path, mtime_ns, size) of every input without reading contents.
+
+        known holds entries already stat'd elsewhere, such as the discovery
+        scan; only paths are stat'd here.
+        """
+        entries = [f"{path}\0{mtime}\0{size}" if mtime is not None
+                   else f"{path}\0missing"
+                   for path, mtime, size in known]
+        for path in paths:
+            try:
+                st = os.stat(path)
+                entries.append(f"{path}\0{st.st_mtime_ns}\0{st.st_size}")
+            except OSError:
+                entries.append(f"{path}\0missing")
+        entries.sort()
+        return _digest("\n".join(entries).encode())
+
+    def project_changed(self, fingerprint: str) -> bool:
+        return self.data.get("project_fp") != fingerprint
+
+    def update_project_fingerprint(self, fingerprint: str):
+        if self.data.get("project_fp") != fingerprint:
+            self.data["project_fp"] = fingerprint
+            self._dirty = True
     
-    def update_file(self, path: Path):
-        if not path.exists():
-            return
-        
-        key = str(path.resolve())
-        self.data.setdefault("files", {})[key] = {
-            "hash": _hash_file(path),
-            "mtime": path.stat().st_mtime
-        }
+    def dependencies(self) -> list[str]:
+        """Headers and resource files the last successful build read."""
+        return self.data.get("dependencies", [])
+
+    def update_dependencies(self, paths: list[str]):
+        if self.data.get("dependencies") != paths:
+            self.data["dependencies"] = paths
+            self._dirty = True
+    
+    def cached_command(self, key: str) -> dict | None:
+        return self.data.get("command_cache", {}).get(key)
+
+    def store_command(self, key: str, flags: dict):
+        self.data.setdefault("command_cache", {})[key] = flags
+        self._dirty = True
+
+    def invalidate_commands(self):
+        if self.data.get("command_cache"):
+            self.data["command_cache"] = {}
+            self._dirty = True
     
     def config_changed(self, config_hash: str) -> bool:
         return self.data.get("config_hash") != config_hash
     
     def update_config_hash(self, config_hash: str):
-        self.data["config_hash"] = config_hash
+        if self.data.get("config_hash") != config_hash:
+            self.data["config_hash"] = config_hash
+            self._dirty = True
     
     def clear(self):
-        self.data = {"version": 1, "files": {}, "config_hash": ""}
+        """Reset to an empty cache and delete the file.
+
+        The cache is left dirty, so a later save() writes the empty state.
+        """
+        self.data = _empty_cache()
+        self._dirty = True
         if self.cache_path.exists():
             self.cache_path.unlink()
 
-def _hash_file(path: Path, chunk_size: int = 8192) -> str:
-    h = hashlib.sha256()
-    with open(path, "rb") as f:
-        while chunk := f.read(chunk_size):
-            h.update(chunk)
-    return h.hexdigest()[:16]
+def _digest(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()[:16]
 
 def hash_config(config_data: dict) -> str:
-    content = json.dumps(config_data, sort_keys=True)
-    return hashlib.sha256(content.encode()).hexdigest()[:16]
+    return _digest(jsonio.dumps(config_data))
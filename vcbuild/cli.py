@@ -1,17 +1,17 @@
 """Command-line interface."""
 
+import os
 import sys
 import argparse
-import json
 from pathlib import Path
 from typing import NoReturn
 
 from . import __version__
 from . import output
 from . import config as cfg
-from . import discovery
-from . import compiler
-from . import cache
+
+# Build machinery is imported inside the commands that need it, so
+# --version, --init, --show-config and --config-gui start faster
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
@@ -87,13 +87,18 @@ def cmd_init(project_root: Path) -> int:
     return 0
 
 def cmd_clean(config: cfg.Config) -> int:
+    from . import compiler
+    from . import cache
+
     compiler.clean(config)
     build_cache = cache.BuildCache(config.project_root)
     build_cache.clear()
     return 0
 
 def cmd_show_config(config: cfg.Config) -> int:
-    print(json.dumps(config.data, indent=2))
+    from . import jsonio
+
+    print(jsonio.dumps_pretty(config.data))
     return 0
 
 def cmd_config_gui(project_root: Path) -> int:
@@ -111,6 +116,9 @@ def cmd_config_gui(project_root: Path) -> int:
 
 def cmd_build(config: cfg.Config, profile: str,
               verbose: bool, dry_run: bool) -> int:
+    from . import discovery
+    from . import compiler
+    from . import cache
 
     sources = discovery.discover(config)
 
@@ -130,9 +138,31 @@ def cmd_build(config: cfg.Config, profile: str,
 
     if verbose:
         for src in sources.sources:
-            output.detail(f"    {src.relative_to(config.project_root)}")
-
-    result = compiler.build(config, sources, profile, verbose, dry_run)
+            output.detail(f"    {os.path.relpath(src, config.project_root)}")
+
+    build_cache = None
+    # The flags derive from these alone, so they stand in for the command line
+    config_hash = cache.hash_config({"vcbuild": __version__, "profile": profile,
+                                     "config": config.data})
+    if not dry_run:
+        build_cache = cache.BuildCache(config.project_root)
+        if build_cache.config_changed(config_hash):
+            build_cache.invalidate_commands()
+        extras = compiler.extra_inputs(config, sources)
+        scanned = list(zip(sources.sources, sources.mtimes, sources.sizes))
+        project_fp = build_cache.project_fingerprint(
+            extras + build_cache.dependencies(), scanned)
+
+        output_path = (config.project_root / proj.get("output_dir", "build")
+                       / proj.get("output_name", "output.exe"))
+        if (not build_cache.config_changed(config_hash)
+                and not build_cache.project_changed(project_fp)
+                and output_path.exists()):
+            output.success("  Up to date")
+            return 0
+
+    result = compiler.build(config, sources, profile, verbose, dry_run,
+                            build_cache)
 
     for w in result.warnings[:10]:
         output.warning(w)
@@ -145,6 +175,18 @@ def cmd_build(config: cfg.Config, profile: str,
     if dry_run:
         return 0
 
+    if result.success:
+        build_cache.update_config_hash(config_hash)
+        if result.dependencies is None:
+            # Inputs are unknown, so the next build cannot be skipped
+            project_fp = ""
+        else:
+            build_cache.update_dependencies(result.dependencies)
+            project_fp = build_cache.project_fingerprint(
+                extras + result.dependencies, scanned)
+        build_cache.update_project_fingerprint(project_fp)
+        build_cache.save()
+
     out_path = ""
     if result.success and result.output_path:
         out_path = str(result.output_path.relative_to(config.project_root))
@@ -1,15 +1,22 @@
 """MSVC toolchain detection and invocation."""
 
 import os
+import re
 import subprocess
 import shutil
 import time
+import functools
+import itertools
 from pathlib import Path
 from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
 
+from . import __version__
 from .config import Config
 from .discovery import SourceSet
+from .cache import BuildCache, hash_config
 from . import output
+from . import jsonio
 
 VCVARS_LOCATIONS = [
     r"C:\Program Files\Microsoft Visual Studio\2022\Enterprise\VC\Auxiliary\Build\vcvarsall.bat",
@@ -20,12 +27,80 @@ VCVARS_LOCATIONS = [
     r"C:\Program Files (x86)\Microsoft Visual Studio\2019\Community\VC\Auxiliary\Build\vcvarsall.bat",
 ]
 
+# file(line): error C2065: ...  /  foo.obj : warning LNK4075: ...
+# LINK : fatal error LNK1104: ...  /  cl : Command line warning D9025 : ...
+_DIAG_RE = re.compile(
+    r"(?:.+?: )?(?:fatal |[Cc]ommand line )?(error|warning) [A-Z]+\d+\s*:"
+)
+
+# Quoted names in an .rc script; existing files among them are inputs
+_RC_STRING_RE = re.compile(r'"((?:[^"\\\r\n]|\\.)+)"')
+
+# Files an .rc script can pull in that may themselves name more files
+_RC_NESTED_EXTENSIONS = (".rc", ".rc2", ".dlg", ".h", ".hh", ".hpp", ".hxx")
+
+# Intermediates cl.exe/link.exe drop in the working directory when
+# output paths are not honoured
+STRAY_EXTENSIONS = (".obj", ".pdb", ".idb", ".ilk")
+
 WDK_LOCATIONS = [
     r"C:\Program Files (x86)\Windows Kits\10",
     r"C:\Program Files\Windows Kits\10",
 ]
 
-@dataclass
+# Lookup tables for the _cl_* flag helpers; shared, never mutated
+_STD_MAP = {
+    "c11": "/std:c11",
+    "c17": "/std:c17",
+    "c++17": "/std:c++17",
+    "c++20": "/std:c++20",
+    "c++23": "/std:c++23",
+    "c++latest": "/std:c++latest"
+}
+
+_OPT_MAP = {
+    "none": ("/Od",),
+    "size": ("/O1",),
+    "speed": ("/O2",),
+    "full": ("/O2", "/GL")
+}
+
+_DBG_MAP = {
+    "none": (),
+    "minimal": ("/Zi",),
+    "full": ("/Zi", "/RTC1")
+}
+
+_FP_MAP = {
+    "precise": "/fp:precise",
+    "fast": "/fp:fast",
+    "strict": "/fp:strict"
+}
+
+_CC_MAP = {
+    "cdecl": "/Gd",
+    "stdcall": "/Gr",
+    "fastcall": "/Gz",
+    "vectorcall": "/Gv"
+}
+
+# On unless disabled in config; _command_flags masks them in this order
+_DEFAULT_CL_FLAGS = ("/Gy", "/GF", "/permissive-", "/Zc:__cplusplus", "/utf-8")
+
+# Search paths vcvarsall.bat extends; a saved capture is only reused
+# while every folder it added to them exists
+_ENV_SEARCH_VARS = ("PATH", "INCLUDE", "LIB", "LIBPATH")
+
+# target_os -> (NTDDI_VERSION, _WIN32_WINNT)
+_NTDDI_MAP = {
+    "win7":  ("0x06010000", "0x0601"),
+    "win8":  ("0x06020000", "0x0602"),
+    "win81": ("0x06030000", "0x0603"),
+    "win10": ("0x0A000000", "0x0A00"),
+    "win11": ("0x0A00000B", "0x0A00"),
+}
+
+@dataclass(slots=True)
 class BuildResult:
     success: bool
     output_path: Path | None
@@ -33,62 +108,256 @@ class BuildResult:
     warnings: list[str]
     duration: float = 0.0
     files_compiled: int = 0
+    # Project headers and resource files read, or None if unknown
+    dependencies: list[str] | None = None
 
+def _toolchain_cache_dir() -> Path:
+    """Per-user directory for persisted toolchain discovery results."""
+    local = os.environ.get("LOCALAPPDATA")
+    if local:
+        return Path(local) / "vcbuild"
+    return Path.home() / ".vcbuild"
+
+@functools.lru_cache(maxsize=1)
 def find_vcvars() -> Path | None:
-    for loc in VCVARS_LOCATIONS:
-        path = Path(loc)
+    """Locate vcvarsall.bat.
+
+    VCBUILD_VCVARS overrides discovery. Otherwise the last known location
+    is reused while it still exists and the set of installed Visual Studio
+    instances is unchanged, and a full search (vswhere, then the default
+    install paths) is only done and persisted when either differs.
+    """
+    override = os.environ.get("VCBUILD_VCVARS")
+    if override:
+        path = Path(override)
         if path.exists():
             return path
+        output.warning(f"VCBUILD_VCVARS does not exist, ignoring: {override}")
+
+    marker = _toolchain_cache_dir() / "vcvars.json"
+    instances = _vs_instances()
+    try:
+        saved = jsonio.loads(marker.read_bytes())
+        if saved["instances"] == instances and Path(saved["path"]).exists():
+            return Path(saved["path"])
+    except (ValueError, OSError, KeyError, TypeError):
+        pass
+
+    path = _vswhere_vcvars()
+    if path is None:
+        path = next((Path(loc) for loc in VCVARS_LOCATIONS
+                     if Path(loc).exists()), None)
+    if path is not None:
+        try:
+            marker.parent.mkdir(parents=True, exist_ok=True)
+            marker.write_bytes(jsonio.dumps({"path": str(path),
+                                             "instances": instances}))
+            # Plain-text marker from older versions
+            (marker.parent / "vcvars").unlink(missing_ok=True)
+        except OSError:
+            pass
+    return path
+
+def _vs_instances() -> list[str]:
+    """IDs of the Visual Studio instances the installer has registered.
+
+    One directory listing, so installing or removing a version next to
+    the remembered one is noticed without running vswhere.
+    """
+    root = os.environ.get("ProgramData", r"C:\ProgramData")
+    instances = Path(root) / "Microsoft" / "VisualStudio" / "Packages" / "_Instances"
+    try:
+        with os.scandir(instances) as it:
+            return sorted(e.name for e in it if e.is_dir())
+    except OSError:
+        return []
+
+def forget_toolchain():
+    """Delete persisted toolchain discovery so the next build searches again."""
+    find_vcvars.cache_clear()
+    _load_msvc_env.cache_clear()
+    cache_dir = _toolchain_cache_dir()
+    try:
+        for pattern in ("vcvars", "vcvars.json", "vcvars-*.json", "env-*.json"):
+            for path in cache_dir.glob(pattern):
+                path.unlink()
+    except OSError:
+        pass
+
+def _vswhere_vcvars() -> Path | None:
+    """Ask vswhere.exe for vcvarsall.bat of the newest install with C++ tools.
+
+    Covers every edition and year, including Build Tools and installs
+    outside the default location.
+    """
+    root = os.environ.get("ProgramFiles(x86)", r"C:\Program Files (x86)")
+    vswhere = Path(root) / "Microsoft Visual Studio" / "Installer" / "vswhere.exe"
+    if not vswhere.exists():
+        return None
+
+    try:
+        result = subprocess.run(
+            [str(vswhere), "-latest", "-products", "*",
+             "-requires", "Microsoft.VisualStudio.Component.VC.Tools.x86.x64",
+             "-find", r"VC\Auxiliary\Build\vcvarsall.bat"],
+            capture_output=True, text=True
+        )
+    except OSError:
+        return None
+
+    for line in result.stdout.splitlines():
+        line = line.strip()
+        if line and Path(line).exists():
+            return Path(line)
     return None
 
+def _toolset_version(vcvars: Path) -> str:
+    """Default MSVC toolset version vcvarsall.bat selects, e.g. 14.38.33130."""
+    try:
+        return (vcvars.parent / "Microsoft.VCToolsVersion.default.txt").read_text(
+            encoding="utf-8").strip()
+    except OSError:
+        return ""
+
+def _env_cache_file(vcvars: Path, arch: str) -> Path:
+    # Toolset servicing can leave vcvarsall.bat itself untouched
+    mtime = vcvars.stat().st_mtime_ns
+    toolset = _toolset_version(vcvars) or "unknown"
+    return _toolchain_cache_dir() / f"vcvars-{arch}-{mtime}-{toolset}.json"
+
+@functools.lru_cache(maxsize=None)
+def _load_msvc_env(vcvars: Path, arch: str) -> dict[str, str] | None:
+    """Return the current environment with vcvarsall.bat's changes for arch.
+
+    Only the variables vcvarsall.bat adds or changes are persisted, per
+    arch, vcvarsall.bat mtime and toolset version, so the batch file only
+    runs again after Visual Studio is updated or a folder it added is
+    gone. They are laid over the live environment on every load, and
+    memoized so PCH, resource and main compiles share one copy.
+    """
+    cache_file = _env_cache_file(vcvars, arch)
+    cache_dir = cache_file.parent
+    delta = None
+    try:
+        cached = jsonio.loads(cache_file.read_bytes())
+        if (cached.get("vcvars") == str(vcvars)
+                and _env_dirs_exist(cached["prepend"])):
+            delta = cached["set"], cached["prepend"]
+    except (ValueError, OSError, AttributeError, KeyError, TypeError):
+        pass
+
+    if delta is None:
+        delta = _capture_vcvars_delta(vcvars, arch)
+        if delta is None:
+            return None
+        try:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            cache_file.write_bytes(jsonio.dumps(
+                {"vcvars": str(vcvars), "set": delta[0], "prepend": delta[1]}))
+            # Older versions saved the whole environment, secrets included
+            for legacy in cache_dir.glob("env-*.json"):
+                legacy.unlink()
+            for stale in cache_dir.glob(f"vcvars-{arch}-*.json"):
+                if stale != cache_file:
+                    stale.unlink()
+        except OSError:
+            pass
+
+    changed, prepended = delta
+    env = {k.upper(): v for k, v in os.environ.items()}
+    env.update(changed)
+    for key, prefix in prepended.items():
+        env[key] = prefix + env.get(key, "")
+    return env
+
+def _forget_msvc_env(vcvars: Path, arch: str):
+    """Drop the saved and memoized capture so the next load reruns vcvarsall.bat."""
+    _load_msvc_env.cache_clear()
+    try:
+        _env_cache_file(vcvars, arch).unlink(missing_ok=True)
+    except OSError:
+        pass
+
+def _env_dirs_exist(prepended: dict[str, str]) -> bool:
+    """Whether every folder vcvarsall.bat put on a search path still exists."""
+    return all(os.path.isdir(d)
+               for key in _ENV_SEARCH_VARS
+               for d in prepended.get(key, "").split(";") if d)
+
+def _capture_vcvars_delta(vcvars: Path, arch: str
+                          ) -> tuple[dict[str, str], dict[str, str]] | None:
+    """Run vcvarsall.bat and diff its environment against os.environ.
+
+    Returns (changed, prepended): variables set to a new value, and the
+    prefixes put in front of an existing list such as PATH or INCLUDE.
+    """
+    result = subprocess.run(f'"{vcvars}" {arch} >nul && set',
+                            shell=True, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+
+    before = {k.upper(): v for k, v in os.environ.items()}
+    changed = {}
+    prepended = {}
+    seen = False
+    for line in result.stdout.splitlines():
+        key, sep, value = line.partition("=")
+        if not (sep and key):
+            continue
+        seen = True
+        key = key.upper()
+        old = before.get(key)
+        if value == old:
+            continue
+        # vcvarsall.bat extends lists as "new;%VAR%", which leaves a
+        # trailing ';' when VAR was empty
+        if old and value.endswith(";" + old):
+            prepended[key] = value[:-len(old)]
+        elif not old and value.endswith(";"):
+            prepended[key] = value
+        else:
+            changed[key] = value
+    if not seen:
+        return None
+    return changed, prepended
+
+def _find_tool(name: str, env: dict[str, str]) -> str | None:
+    """Resolve a tool against the PATH of an MSVC environment block."""
+    path = next((v for k, v in env.items() if k.upper() == "PATH"), None)
+    return shutil.which(name, path=path)
+
+@functools.lru_cache(maxsize=1)
 def find_wdk() -> tuple[Path | None, str | None]:
     """Find WDK installation and latest version."""
     for loc in WDK_LOCATIONS:
         kit_root = Path(loc)
-        if not kit_root.exists():
+        # Track the newest version in one pass instead of sorting them all
+        best = None
+        try:
+            with os.scandir(kit_root / "Include") as it:
+                for entry in it:
+                    name = entry.name
+                    if (name.startswith("10.") and (best is None or name > best)
+                            and entry.is_dir(follow_symlinks=False)):
+                        best = name
+        except OSError:
             continue
-        inc_dir = kit_root / "Include"
-        if not inc_dir.exists():
-            continue
-        versions = sorted(
-            [d.name for d in inc_dir.iterdir()
-             if d.is_dir() and d.name.startswith("10.")],
-            reverse=True
-        )
-        if versions:
-            return kit_root, versions[0]
+        if best:
+            return kit_root, best
     return None, None
 
 def _cl_standard(std: str) -> str:
-    return {
-        "c11": "/std:c11",
-        "c17": "/std:c17",
-        "c++17": "/std:c++17",
-        "c++20": "/std:c++20",
-        "c++23": "/std:c++23",
-        "c++latest": "/std:c++latest"
-    }.get(std, "/std:c++20")
-
-def _cl_optimization(opt: str, profile: str) -> list[str]:
+    return _STD_MAP.get(std, "/std:c++20")
+
+def _cl_optimization(opt: str, profile: str) -> tuple[str, ...]:
     if opt == "auto":
         opt = "full" if profile == "release" else "none"
+    return _OPT_MAP.get(opt, ("/O2",))
 
-    return {
-        "none": ["/Od"],
-        "size": ["/O1"],
-        "speed": ["/O2"],
-        "full": ["/O2", "/GL"]
-    }.get(opt, ["/O2"])
-
-def _cl_debug(dbg: str, profile: str) -> list[str]:
+def _cl_debug(dbg: str, profile: str) -> tuple[str, ...]:
     if dbg == "auto":
         dbg = "minimal" if profile == "release" else "full"
-
-    return {
-        "none": [],
-        "minimal": ["/Zi"],
-        "full": ["/Zi", "/RTC1"]
-    }.get(dbg, [])
+    return _DBG_MAP.get(dbg, ())
 
 def _cl_runtime(rt: str, profile: str) -> str:
     debug = profile == "debug"
@@ -105,19 +374,10 @@ def _cl_warnings(cfg: dict) -> list[str]:
     return flags
 
 def _cl_floating_point(fp: str) -> str:
-    return {
-        "precise": "/fp:precise",
-        "fast": "/fp:fast",
-        "strict": "/fp:strict"
-    }.get(fp, "/fp:precise")
+    return _FP_MAP.get(fp, "/fp:precise")
 
 def _cl_calling_convention(cc: str) -> str:
-    return {
-        "cdecl": "/Gd",
-        "stdcall": "/Gr",
-        "fastcall": "/Gz",
-        "vectorcall": "/Gv"
-    }.get(cc, "/Gd")
+    return _CC_MAP.get(cc, "/Gd")
 
 def _cl_char_set(cs: str) -> list[str]:
     if cs == "unicode":
@@ -203,14 +463,7 @@ def _driver_defines(drv_cfg: dict) -> list[str]:
     """Generate kernel-mode defines."""
     defines = ["_KERNEL_MODE", "NTDDI_WIN10_RS5=0x0A000006"]
     target_os = drv_cfg.get("target_os", "win10")
-    ntddi_map = {
-        "win7":  ("0x06010000", "0x0601"),
-        "win8":  ("0x06020000", "0x0602"),
-        "win81": ("0x06030000", "0x0603"),
-        "win10": ("0x0A000000", "0x0A00"),
-        "win11": ("0x0A00000B", "0x0A00"),
-    }
-    ntddi, winver = ntddi_map.get(target_os, ("0x0A000000", "0x0A00"))
+    ntddi, winver = _NTDDI_MAP.get(target_os, ("0x0A000000", "0x0A00"))
     defines.append(f"NTDDI_VERSION={ntddi}")
     defines.append(f"_WIN32_WINNT={winver}")
     if drv_cfg.get("minifilter"):
@@ -218,26 +471,70 @@ def _driver_defines(drv_cfg: dict) -> list[str]:
     return defines
 
 
-def build_command(config: Config, sources: SourceSet, profile: str) -> tuple[str, Path]:
+def build_command(config: Config, sources: SourceSet, profile: str,
+                  output_dir: Path, obj_dir: Path,
+                  build_cache: BuildCache | None = None,
+                  wdk: tuple[Path | None, str | None] = (None, None),
+                  toolset: str = ""
+                  ) -> tuple[list[str], Path]:
     cfg = config.data
-    comp = cfg.get("compiler", {})
-    link = cfg.get("linker", {})
-    proj = cfg.get("project", {})
-    drv_cfg = cfg.get("driver", {})
-    is_driver = drv_cfg.get("enabled", False)
+    proj = cfg.get("project") or {}
+    is_driver = (cfg.get("driver") or {}).get("enabled", False)
 
-    output_dir = config.project_root / proj.get("output_dir", "build")
-    output_dir.mkdir(parents=True, exist_ok=True)
     output_path = output_dir / proj.get("output_name", "output.exe")
-    obj_dir = output_dir / "obj"
-    obj_dir.mkdir(exist_ok=True)
 
-    cl_flags = []
-    cl_flags.append(_cl_standard(comp.get("standard", "c++20")))
-    cl_flags.append(_cl_runtime(comp.get("runtime", "dynamic"), profile))
-    cl_flags.extend(_cl_optimization(comp.get("optimization", "auto"), profile))
-    cl_flags.extend(_cl_debug(comp.get("debug_info", "auto"), profile))
-    cl_flags.extend(_cl_warnings(comp.get("warnings", {})))
+    # Flags depend only on the resolved config and toolchain, not on the
+    # source list, so they can be reused from the previous build
+    key = None
+    flags = None
+    if build_cache is not None:
+        key = hash_config({
+            "vcbuild": __version__,
+            "config": cfg,
+            "profile": profile,
+            "root": str(config.project_root),
+            "include_dirs": [str(d) for d in sources.include_dirs],
+            "wdk": [str(v) for v in wdk] if is_driver else None,
+            "toolset": toolset
+        })
+        flags = build_cache.cached_command(key)
+
+    if flags is None:
+        cl_flags, link_flags = _command_flags(config, sources, profile,
+                                              output_dir, obj_dir, output_path,
+                                              wdk, toolset)
+        if build_cache is not None:
+            build_cache.store_command(key, {"cl": cl_flags, "link": link_flags})
+    else:
+        cl_flags, link_flags = flags["cl"], flags["link"]
+
+    # Absolute sources plus a directory /Fo keep every .obj inside obj_dir
+    argv = ["cl.exe", "/nologo", *cl_flags,
+            *(os.path.abspath(s) for s in sources.sources),
+            "/link", *link_flags]
+
+    return argv, output_path
+
+def _command_flags(config: Config, sources: SourceSet, profile: str,
+                   output_dir: Path, obj_dir: Path, output_path: Path,
+                   wdk: tuple[Path | None, str | None], toolset: str = ""
+                   ) -> tuple[list[str], list[str]]:
+    cfg = config.data
+    comp = cfg.get("compiler") or {}
+    link = cfg.get("linker") or {}
+    proj = cfg.get("project") or {}
+    drv_cfg = cfg.get("driver") or {}
+    pch_cfg = cfg.get("pch") or {}
+    is_driver = drv_cfg.get("enabled", False)
+    arch = proj.get("architecture", "x64")
+
+    cl_flags = [
+        _cl_standard(comp.get("standard", "c++20")),
+        _cl_runtime(comp.get("runtime", "dynamic"), profile),
+        *_cl_optimization(comp.get("optimization", "auto"), profile),
+        *_cl_debug(comp.get("debug_info", "auto"), profile),
+        *_cl_warnings(comp.get("warnings", {})),
+    ]
 
     if comp.get("exceptions", True) and not is_driver:
         cl_flags.append("/EHsc")
@@ -245,29 +542,25 @@ def build_command(config: Config, sources: SourceSet, profile: str) -> tuple[str
     if not comp.get("rtti", True):
         cl_flags.append("/GR-")
 
-    cl_flags.append(_cl_floating_point(comp.get("floating_point", "precise")))
-    cl_flags.append(_cl_calling_convention(comp.get("calling_convention", "cdecl")))
-    cl_flags.extend(_cl_char_set(comp.get("char_set", "unicode")))
-
-    if comp.get("function_level_linking", True):
-        cl_flags.append("/Gy")
-
-    if comp.get("string_pooling", True):
-        cl_flags.append("/GF")
+    cl_flags += (
+        _cl_floating_point(comp.get("floating_point", "precise")),
+        _cl_calling_convention(comp.get("calling_convention", "cdecl")),
+        *_cl_char_set(comp.get("char_set", "unicode")),
+    )
 
     conformance = comp.get("conformance", {})
-    if not conformance.get("permissive", False):
-        cl_flags.append("/permissive-")
-    if conformance.get("cplusplus_macro", True):
-        cl_flags.append("/Zc:__cplusplus")
-
-    cl_flags.append("/utf-8")
+    cl_flags.extend(itertools.compress(_DEFAULT_CL_FLAGS, (
+        comp.get("function_level_linking", True),
+        comp.get("string_pooling", True),
+        not conformance.get("permissive", False),
+        conformance.get("cplusplus_macro", True),
+        True,
+    )))
 
     security = comp.get("security", {})
     if is_driver:
         cl_flags.extend(_driver_compiler_flags(drv_cfg))
-        for d in _driver_defines(drv_cfg):
-            cl_flags.append(f"/D{d}")
+        cl_flags.extend(f"/D{d}" for d in _driver_defines(drv_cfg))
     else:
         if security.get("buffer_checks", True):
             cl_flags.append("/GS")
@@ -277,32 +570,30 @@ def build_command(config: Config, sources: SourceSet, profile: str) -> tuple[str
     if comp.get("parallel", True):
         cl_flags.append("/MP")
 
-    for d in comp.get("defines", []):
-        cl_flags.append(f"/D{d}")
-
+    cl_flags.extend(f"/D{d}" for d in comp.get("defines", []))
     cl_flags.extend(comp.get("additional_flags", []))
 
     # PCH support
-    pch_cfg = cfg.get("pch", {})
     if pch_cfg.get("enabled") and pch_cfg.get("header"):
         pch_header = pch_cfg["header"]
         pch_out = output_dir / "pch.pch"
-        cl_flags.append(f'/Yu"{pch_header}"')
-        cl_flags.append(f'/Fp"{pch_out}"')
+        cl_flags += (f"/Yu{pch_header}", f"/Fp{pch_out}")
 
-    for inc in sources.include_dirs:
-        cl_flags.append(f'/I"{inc}"')
+    cl_flags.extend(f"/I{inc}" for inc in sources.include_dirs)
 
     # Driver WDK include paths
+    wdk_root, wdk_ver = wdk
     if is_driver:
-        wdk_root, wdk_ver = find_wdk()
         if wdk_root and wdk_ver:
-            arch = proj.get("architecture", "x64")
-            for p in _driver_include_paths(wdk_root, wdk_ver, arch, drv_cfg):
-                cl_flags.append(f'/I"{p}"')
+            cl_flags.extend(
+                f"/I{p}"
+                for p in _driver_include_paths(wdk_root, wdk_ver, arch, drv_cfg)
+            )
 
-    cl_flags.append(f'/Fo"{obj_dir}\\\\"')
-    cl_flags.append(f'/Fd"{output_dir}\\vc.pdb"')
+    cl_flags += (f"/Fo{obj_dir}{os.sep}", f"/Fd{output_dir / 'vc.pdb'}")
+    # One <source>.json per source listing the headers it included
+    if _supports_source_dependencies(toolset):
+        cl_flags += ("/sourceDependencies", str(obj_dir))
 
     link_flags = []
 
@@ -323,13 +614,11 @@ def build_command(config: Config, sources: SourceSet, profile: str) -> tuple[str
     # Driver-specific linker flags
     if is_driver:
         link_flags.extend(_driver_linker_flags(drv_cfg))
-        wdk_root, wdk_ver = find_wdk()
         if wdk_root and wdk_ver:
-            arch = proj.get("architecture", "x64")
-            for lp in _driver_lib_paths(wdk_root, wdk_ver, arch):
-                link_flags.append(f'/LIBPATH:"{lp}"')
-            for lib in _driver_libraries(drv_cfg):
-                link_flags.append(lib)
+            link_flags.extend(
+                f"/LIBPATH:{lp}" for lp in _driver_lib_paths(wdk_root, wdk_ver, arch)
+            )
+            link_flags.extend(_driver_libraries(drv_cfg))
 
     entry_point = link.get("entry_point")
     if entry_point and not is_driver:
@@ -338,7 +627,7 @@ def build_command(config: Config, sources: SourceSet, profile: str) -> tuple[str
     def_file = link.get("def_file")
     if def_file:
         def_path = config.project_root / def_file
-        link_flags.append(f'/DEF:"{def_path}"')
+        link_flags.append(f"/DEF:{def_path}")
 
     stack_size = link.get("stack_size")
     if stack_size:
@@ -350,30 +639,168 @@ def build_command(config: Config, sources: SourceSet, profile: str) -> tuple[str
 
     if link.get("generate_map", False):
         map_file = output_dir / (proj.get("name", "output") + ".map")
-        link_flags.append(f'/MAP:"{map_file}"')
-
-    for lib in link.get("libraries", []):
-        link_flags.append(f"{lib}")
-
-    arch = proj.get("architecture", "x64")
-    for lp in link.get("library_paths", []):
-        lp = lp.replace("${ARCH}", arch)
-        link_flags.append(f'/LIBPATH:"{lp}"')
-
-    link_flags.extend(link.get("additional_flags", []))
-
-    link_flags.append(f'/OUT:"{output_path}"')
-
-    source_list = " ".join(f'"{s}"' for s in sources.sources)
-    cl_cmd = f'cl.exe /nologo {" ".join(cl_flags)} {source_list} /link {" ".join(link_flags)}'
+        link_flags.append(f"/MAP:{map_file}")
+
+    link_flags.extend(str(lib) for lib in link.get("libraries", []))
+    link_flags.extend(
+        f"/LIBPATH:{lp.replace('${ARCH}', arch)}"
+        for lp in link.get("library_paths", [])
+    )
+    link_flags += (*link.get("additional_flags", []), f"/OUT:{output_path}")
+
+    return cl_flags, link_flags
+
+def extra_inputs(config: Config, sources: SourceSet) -> list[str | Path]:
+    """Non-source files whose changes must also trigger a rebuild.
+
+    Headers and files referenced from .rc scripts are not known until a
+    build reports them; see BuildResult.dependencies.
+    """
+    root = config.project_root
+    inputs = []
+    if config.get("resources", "enabled"):
+        inputs.extend(root / f for f in config.get("resources", "files", default=[]))
+    pch_source = config.get("pch", "source")
+    if config.get("pch", "enabled") and pch_source:
+        inputs.append(root / pch_source)
+    def_file = config.get("linker", "def_file")
+    if def_file:
+        inputs.append(root / def_file)
+    # Every place link.exe may find a library; system libraries simply
+    # stay missing
+    arch = config.get("project", "architecture", default="x64")
+    lib_dirs = [root / lp.replace("${ARCH}", arch)
+                for lp in config.get("linker", "library_paths", default=[])]
+    for lib in config.get("linker", "libraries", default=[]):
+        inputs.append(root / lib)
+        inputs.extend(d / lib for d in lib_dirs)
+    return inputs
+
+def _supports_source_dependencies(toolset: str) -> bool:
+    """/sourceDependencies arrived with toolset 14.27 (VS 2019 16.7).
+
+    Older cl.exe ignores the switch and takes its directory argument for
+    an input file, which then breaks the link.
+    """
+    try:
+        major, minor = (int(p) for p in toolset.split(".")[:2])
+    except ValueError:
+        return False
+    return (major, minor) >= (14, 27)
+
+def _read_dependencies(obj_dir: Path, sources: list[str],
+                       system_dirs: list[str]) -> list[str] | None:
+    """Headers listed in the /sourceDependencies reports for sources.
+
+    Headers under system_dirs only change with the toolchain and are left
+    out. Returns None if any report is missing.
+    """
+    prefixes = tuple(os.path.join(os.path.normcase(d), "")
+                     for d in system_dirs if d)
+    found = set()
+    for src in sources:
+        report = obj_dir / (os.path.basename(src) + ".json")
+        try:
+            includes = jsonio.loads(report.read_bytes())["Data"]["Includes"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        found.update(inc for inc in includes
+                     if not os.path.normcase(inc).startswith(prefixes))
+    return sorted(found)
+
+def _resource_dependencies(rc_file: Path, search_dirs: list[Path]) -> list[str]:
+    """Files an .rc script pulls in: #include targets, icons, manifests.
+
+    rc.exe reports no dependencies, so every quoted name is resolved the
+    way it searches (the script's directory, then the /i directories) and
+    the ones that exist are kept. Included scripts and headers are
+    followed in turn.
+    """
+    found = set()
+    pending = [rc_file]
+    while pending:
+        script = pending.pop()
+        try:
+            raw = script.read_bytes()
+        except OSError:
+            continue
+        if raw.startswith((b"\xff\xfe", b"\xfe\xff")):
+            text = raw.decode("utf-16")
+        else:
+            text = raw.decode("utf-8", "replace")
+        for m in _RC_STRING_RE.finditer(text):
+            name = m.group(1).replace("\\\\", "\\")
+            for base in (script.parent, *search_dirs):
+                candidate = base / name
+                if not candidate.is_file():
+                    continue
+                path = os.path.normpath(candidate)
+                if path not in found:
+                    found.add(path)
+                    if path.lower().endswith(_RC_NESTED_EXTENSIONS):
+                        pending.append(Path(path))
+                break
+    return sorted(found)
+
+def _response_file_argv(argv: list[str], rsp_dir: Path) -> list[str]:
+    """Move cl and link arguments into cl.rsp / link.rsp in rsp_dir.
+
+    The remaining command line is four tokens regardless of source count,
+    so large projects stay clear of CreateProcess's 32K character limit.
+    """
+    split = argv.index("/link")
+    cl_rsp = rsp_dir / "cl.rsp"
+    link_rsp = rsp_dir / "link.rsp"
+    # Response files follow command-line quoting; UTF-16 with a BOM is the
+    # encoding both cl.exe and link.exe read without a code page
+    for rsp, args in ((cl_rsp, argv[1:split]), (link_rsp, argv[split + 1:])):
+        rsp.write_text("\n".join(subprocess.list2cmdline([a]) for a in args) + "\n",
+                       encoding="utf-16")
+    return [argv[0], f"@{cl_rsp}", "/link", f"@{link_rsp}"]
+
+def _run_streaming(args, verbose: bool = False,
+                   **popen_kwargs) -> tuple[int, list[str], list[str]]:
+    """Run a tool and classify its merged output line by line as it arrives.
+
+    Returns (returncode, errors, warnings). Other lines are echoed when
+    verbose and otherwise dropped, so memory stays flat on chatty builds.
+    """
+    errors = []
+    warnings = []
+
+    with subprocess.Popen(
+        args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1,
+        **popen_kwargs
+    ) as proc:
+        for line in proc.stdout:
+            line = line.strip()
+            if not line:
+                continue
+            # Every diagnostic contains ": "; bare echoes like "main.cpp"
+            # never need the regex
+            m = _DIAG_RE.match(line) if ": " in line else None
+            if m is None:
+                if verbose:
+                    output.detail(line)
+            elif m.group(1) == "error":
+                errors.append(line)
+            else:
+                warnings.append(line)
+        returncode = proc.wait()
 
-    return cl_cmd, output_path
+    return returncode, errors, warnings
 
-def compile_pch(config: Config, vcvars: Path, arch: str,
+def compile_pch(config: Config, env: dict[str, str],
                 profile: str, sources: SourceSet,
-                verbose: bool = False) -> bool:
+                output_dir: Path, obj_dir: Path,
+                verbose: bool = False, toolset: str = "") -> bool:
     """Compile precompiled header if configured."""
-    pch_cfg = config.data.get("pch", {})
+    cfg = config.data
+    pch_cfg = cfg.get("pch") or {}
     if not pch_cfg.get("enabled") or not pch_cfg.get("header"):
         return True
 
@@ -386,48 +813,49 @@ def compile_pch(config: Config, vcvars: Path, arch: str,
         output.error(f"PCH source not found: {pch_src_path}")
         return False
 
-    comp = config.data.get("compiler", {})
-    output_dir = config.project_root / config.data.get("project", {}).get("output_dir", "build")
-    output_dir.mkdir(parents=True, exist_ok=True)
-    obj_dir = output_dir / "obj"
-    obj_dir.mkdir(exist_ok=True)
+    comp = cfg.get("compiler") or {}
     pch_out = output_dir / "pch.pch"
 
-    cl_flags = ["/nologo"]
-    cl_flags.append(_cl_standard(comp.get("standard", "c++20")))
-    cl_flags.append(_cl_runtime(comp.get("runtime", "dynamic"), profile))
-    cl_flags.extend(_cl_optimization(comp.get("optimization", "auto"), profile))
-    cl_flags.extend(_cl_debug(comp.get("debug_info", "auto"), profile))
+    argv = [
+        "cl.exe", "/nologo",
+        _cl_standard(comp.get("standard", "c++20")),
+        _cl_runtime(comp.get("runtime", "dynamic"), profile),
+        *_cl_optimization(comp.get("optimization", "auto"), profile),
+        *_cl_debug(comp.get("debug_info", "auto"), profile),
+    ]
     if comp.get("exceptions", True):
-        cl_flags.append("/EHsc")
-
-    for inc in sources.include_dirs:
-        cl_flags.append(f'/I"{inc}"')
-
-    cl_flags.append(f'/Yc"{pch_cfg["header"]}"')
-    cl_flags.append(f'/Fp"{pch_out}"')
-    cl_flags.append(f'/Fo"{obj_dir}\\\\"')
-    cl_flags.append("/c")
-
-    pch_cmd = f'cl.exe {" ".join(cl_flags)} "{pch_src_path}"'
-    full_cmd = f'"{vcvars}" {arch} >nul 2>&1 && {pch_cmd}'
+        argv.append("/EHsc")
+
+    argv.extend(f"/I{inc}" for inc in sources.include_dirs)
+    argv += (f"/Yc{pch_cfg['header']}", f"/Fp{pch_out}",
+             f"/Fo{obj_dir}{os.sep}")
+    if _supports_source_dependencies(toolset):
+        argv += ("/sourceDependencies", str(obj_dir))
+    argv += ("/c", str(pch_src_path))
+
+    cl_path = _find_tool("cl.exe", env)
+    if cl_path is None:
+        output.error("cl.exe not found", "Not on PATH in the MSVC environment")
+        return False
 
     if verbose:
         output.detail(f"Compiling PCH: {pch_cfg['header']}")
 
-    result = subprocess.run(full_cmd, shell=True, capture_output=True, text=True)
-    if result.returncode != 0:
+    returncode, errors, _ = _run_streaming(argv, verbose,
+                                           executable=cl_path, env=env)
+    if returncode != 0:
         output.error("PCH compilation failed")
-        if result.stderr:
-            output.detail(result.stderr.strip())
+        for e in errors:
+            output.detail(e)
         return False
 
     return True
 
-def compile_resources(config: Config, vcvars: Path, arch: str,
-                      verbose: bool = False) -> list[Path]:
+def compile_resources(config: Config, env: dict[str, str],
+                      output_dir: Path, verbose: bool = False) -> list[Path]:
     """Compile .rc files to .res if resources are configured."""
-    res_cfg = config.data.get("resources", {})
+    cfg = config.data
+    res_cfg = cfg.get("resources") or {}
     if not res_cfg.get("enabled", False):
         return []
 
@@ -435,11 +863,13 @@ def compile_resources(config: Config, vcvars: Path, arch: str,
     if not files:
         return []
 
-    output_dir = config.project_root / config.data.get("project", {}).get("output_dir", "build")
-    output_dir.mkdir(parents=True, exist_ok=True)
+    inc_dirs = (cfg.get("sources") or {}).get("include_dirs", [])
+    inc_flags = [f"/i{config.project_root / d}" for d in inc_dirs]
 
-    inc_dirs = config.data.get("sources", {}).get("include_dirs", [])
-    inc_flags = " ".join(f'/i"{config.project_root / d}"' for d in inc_dirs)
+    rc_path = _find_tool("rc.exe", env)
+    if rc_path is None:
+        output.error("rc.exe not found", "Not on PATH in the MSVC environment")
+        return []
 
     compiled = []
     for rc_name in files:
@@ -449,18 +879,18 @@ def compile_resources(config: Config, vcvars: Path, arch: str,
             continue
 
         res_file = output_dir / (rc_file.stem + ".res")
-        rc_cmd = f'rc /nologo {inc_flags} /fo"{res_file}" "{rc_file}"'
-        full_cmd = f'"{vcvars}" {arch} >nul 2>&1 && {rc_cmd}'
+        argv = ["rc.exe", "/nologo", *inc_flags, f"/fo{res_file}", str(rc_file)]
 
         if verbose:
             output.detail(f"Compiling resources: {rc_file.name}")
 
-        result = subprocess.run(full_cmd, shell=True, capture_output=True, text=True)
+        returncode, errors, _ = _run_streaming(argv, verbose,
+                                               executable=rc_path, env=env)
 
-        if result.returncode != 0 or not res_file.exists():
+        if returncode != 0 or not res_file.exists():
             output.error(f"Resource compilation failed: {rc_file.name}")
-            if result.stderr:
-                output.detail(result.stderr.strip())
+            for e in errors:
+                output.detail(e)
             return []
 
         compiled.append(res_file)
@@ -468,7 +898,8 @@ def compile_resources(config: Config, vcvars: Path, arch: str,
     return compiled
 
 def build(config: Config, sources: SourceSet, profile: str,
-          verbose: bool = False, dry_run: bool = False) -> BuildResult:
+          verbose: bool = False, dry_run: bool = False,
+          build_cache: BuildCache | None = None) -> BuildResult:
 
     start_time = time.perf_counter()
 
@@ -477,75 +908,112 @@ def build(config: Config, sources: SourceSet, profile: str,
         output.error("MSVC not found", "Install Visual Studio with C++ workload")
         return BuildResult(False, None, ["MSVC not found"], [])
 
-    arch = config.data.get("project", {}).get("architecture", "x64")
+    cfg = config.data
+    proj = cfg.get("project") or {}
+    arch = proj.get("architecture", "x64")
+    drv_cfg = cfg.get("driver") or {}
+    res_cfg = cfg.get("resources") or {}
+
+    # Created once here; the steps below only receive the paths
+    output_dir = config.project_root / proj.get("output_dir", "build")
+    obj_dir = output_dir / "obj"
+    obj_dir.mkdir(parents=True, exist_ok=True)
 
-    # Driver WDK check
-    drv_cfg = config.data.get("driver", {})
+    # Driver WDK check; resolved once and handed to build_command
+    wdk = (None, None)
     if drv_cfg.get("enabled", False):
-        wdk_root, wdk_ver = find_wdk()
+        wdk = wdk_root, wdk_ver = find_wdk()
         if wdk_root is None:
             output.error("WDK not found", "Install Windows Driver Kit for driver builds")
             return BuildResult(False, None, ["WDK not found"], [])
         output.detail(f"WDK {wdk_ver} at {wdk_root}")
 
-    # Compile PCH if configured
+    # vcvarsall.bat is resolved once; every tool below runs directly
+    # inside the captured environment
+    env = None
     if not dry_run:
-        if not compile_pch(config, vcvars, arch, profile, sources, verbose):
-            return BuildResult(False, None, ["PCH compilation failed"], [])
+        env = _load_msvc_env(vcvars, arch)
+        # A saved capture can outlive the tools it points at; capture once
+        # more before reporting them missing
+        tools = ["cl.exe"]
+        if res_cfg.get("enabled", False) and res_cfg.get("files"):
+            tools.append("rc.exe")
+        if env is not None and any(_find_tool(t, env) is None for t in tools):
+            _forget_msvc_env(vcvars, arch)
+            env = _load_msvc_env(vcvars, arch)
+        if env is None:
+            output.error("Failed to set up MSVC environment", str(vcvars))
+            return BuildResult(False, None, ["MSVC environment setup failed"], [])
+
+    # Decides whether cl.exe is asked for dependency reports
+    if env is not None:
+        toolset = env.get("VCTOOLSVERSION", "").strip()
+    else:
+        toolset = _toolset_version(vcvars)
 
-    # Compile resources if configured
+    # Compile PCH and resources if configured; rc.exe never reads the
+    # PCH, so both tools run at the same time
     res_files = []
     if not dry_run:
-        res_files = compile_resources(config, vcvars, arch, verbose)
-        if config.data.get("resources", {}).get("enabled", False) and not res_files:
-            res_files_cfg = config.data.get("resources", {}).get("files", [])
-            if res_files_cfg:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            pch_job = pool.submit(compile_pch, config, env, profile, sources,
+                                  output_dir, obj_dir, verbose, toolset)
+            res_job = pool.submit(compile_resources, config, env,
+                                  output_dir, verbose)
+            pch_ok = pch_job.result()
+            res_files = res_job.result()
+
+        if not pch_ok:
+            return BuildResult(False, None, ["PCH compilation failed"], [])
+        if res_cfg.get("enabled", False) and not res_files:
+            if res_cfg.get("files", []):
                 return BuildResult(False, None, ["Resource compilation failed"], [])
 
     # Add resource files to linker flags
-    for res_file in res_files:
-        config.data.setdefault("linker", {}).setdefault("additional_flags", [])
-        res_flag = str(res_file)
-        if res_flag not in config.data["linker"]["additional_flags"]:
-            config.data["linker"]["additional_flags"].append(res_flag)
-
-    cl_cmd, output_path = build_command(config, sources, profile)
-
-    full_cmd = f'"{vcvars}" {arch} >nul 2>&1 && {cl_cmd}'
+    if res_files:
+        link_extra = cfg.setdefault("linker", {}).setdefault("additional_flags", [])
+        seen = set(link_extra)
+        for res_file in res_files:
+            res_flag = str(res_file)
+            if res_flag not in seen:
+                link_extra.append(res_flag)
+                seen.add(res_flag)
+
+    argv, output_path = build_command(config, sources, profile,
+                                      output_dir, obj_dir, build_cache, wdk,
+                                      toolset)
+    stray_candidates = {
+        config.project_root / (os.path.splitext(os.path.basename(src))[0] + ext)
+        for src in sources.sources for ext in STRAY_EXTENSIONS
+    }
 
+    # Quoted for display only; the tools themselves receive argv
     if dry_run:
         output.step("Command (dry run):")
-        output.detail(cl_cmd)
+        output.detail(subprocess.list2cmdline(argv))
         return BuildResult(True, output_path, [], [])
 
     if verbose:
-        output.detail(cl_cmd)
-
-    try:
-        result = subprocess.run(
-            full_cmd,
-            shell=True,
-            capture_output=True,
-            text=True
-        )
+        output.detail(subprocess.list2cmdline(argv))
 
-        errors = []
-        warnings = []
+    cl_path = _find_tool("cl.exe", env)
+    if cl_path is None:
+        output.error("cl.exe not found", f"Not on PATH after running {vcvars}")
+        return BuildResult(False, None, ["cl.exe not found"], [])
 
-        for line in (result.stdout + result.stderr).splitlines():
-            line = line.strip()
-            if not line:
-                continue
-            if ": error " in line or line.startswith("error "):
-                errors.append(line)
-            elif ": warning " in line:
-                warnings.append(line)
-            elif verbose:
-                output.detail(line)
+    try:
+        run_argv = _response_file_argv(argv, output_path.parent)
+        returncode, errors, warnings = _run_streaming(
+            run_argv, verbose, executable=cl_path, env=env)
 
-        success = result.returncode == 0 and output_path.exists()
+        success = returncode == 0 and output_path.exists()
 
-        cleanup_stray_files(config.project_root, verbose)
+        dependencies = None
+        if success:
+            dependencies = _build_dependencies(config, sources, env, obj_dir,
+                                               wdk, toolset)
+        else:
+            _remove_stray_outputs(stray_candidates, verbose)
 
         elapsed = time.perf_counter() - start_time
 
@@ -555,26 +1023,78 @@ def build(config: Config, sources: SourceSet, profile: str,
             errors=errors,
             warnings=warnings,
             duration=elapsed,
-            files_compiled=len(sources.sources)
+            files_compiled=len(sources.sources),
+            dependencies=dependencies
         )
 
     except Exception as e:
-        cleanup_stray_files(config.project_root, verbose)
+        _remove_stray_outputs(stray_candidates, verbose)
         elapsed = time.perf_counter() - start_time
         return BuildResult(False, None, [str(e)], [], duration=elapsed)
 
+def _build_dependencies(config: Config, sources: SourceSet,
+                        env: dict[str, str], obj_dir: Path,
+                        wdk: tuple[Path | None, str | None],
+                        toolset: str) -> list[str] | None:
+    """Project files a successful build read besides its sources."""
+    # Reports left in obj_dir by a newer toolset would be stale
+    if not _supports_source_dependencies(toolset):
+        return None
+
+    cfg = config.data
+    pch_cfg = cfg.get("pch") or {}
+    res_cfg = cfg.get("resources") or {}
+
+    compiled = list(sources.sources)
+    if pch_cfg.get("enabled") and pch_cfg.get("header") and pch_cfg.get("source"):
+        compiled.append(pch_cfg["source"])
+
+    system_dirs = [d for k, v in env.items()
+                   if k.upper() in ("INCLUDE", "EXTERNAL_INCLUDE")
+                   for d in v.split(";")]
+    if wdk[0] is not None:
+        system_dirs.append(str(wdk[0]))
+
+    deps = _read_dependencies(obj_dir, compiled, system_dirs)
+    if deps is None:
+        return None
+
+    if res_cfg.get("enabled", False):
+        inc_dirs = [config.project_root / d
+                    for d in (cfg.get("sources") or {}).get("include_dirs", [])]
+        for rc_name in res_cfg.get("files", []):
+            deps.extend(_resource_dependencies(config.project_root / rc_name,
+                                               inc_dirs))
+    return deps
+
+def _remove_stray_outputs(candidates: set[Path], verbose: bool = False):
+    """Remove the specific stray intermediates a build could have produced."""
+    cleaned = []
+    for path in candidates:
+        try:
+            path.unlink()
+            cleaned.append(path.name)
+        except OSError:
+            pass
+
+    if cleaned and verbose:
+        output.detail(f"Cleaned up: {', '.join(sorted(cleaned))}")
+
 def cleanup_stray_files(project_root: Path, verbose: bool = False):
     """Remove stray intermediate files from project root."""
-    patterns = ["*.obj", "*.pdb", "*.idb", "*.ilk"]
     cleaned = []
 
-    for pattern in patterns:
-        for file in project_root.glob(pattern):
-            if file.parent == project_root:
+    try:
+        it = os.scandir(project_root)
+    except OSError:
+        return
+    with it:
+        for entry in it:
+            if entry.name.lower().endswith(STRAY_EXTENSIONS) and entry.is_file():
                 try:
-                    file.unlink()
-                    cleaned.append(file.name)
-                except Exception:
+                    os.unlink(entry.path)
+                    cleaned.append(entry.name)
+                except OSError:
                     pass
 
     if cleaned and verbose:
@@ -589,3 +1109,4 @@ def clean(config: Config):
         output.detail("Nothing to clean")
 
     cleanup_stray_files(config.project_root, verbose=True)
+    forget_toolchain()
@@ -1,5 +1,6 @@
 """Configuration loading, merging, and resolution."""
 
+import copy
 import json
 from pathlib import Path
 from typing import Any
@@ -15,6 +16,8 @@ class Config:
         self.project_root = project_root
     
     def get(self, *keys: str, default: Any = None) -> Any:
+        if len(keys) == 1:
+            return self.data.get(keys[0], default)
         val = self.data
         for k in keys:
             if isinstance(val, dict) and k in val:
@@ -34,21 +37,25 @@ def find_project_root(start: Path) -> Path | None:
     return None
 
 def load(project_root: Path, profile: str = "release") -> Config:
-    config = schema.DEFAULTS.copy()
     config_file = project_root / CONFIG_FILENAME
     
     if config_file.exists():
         try:
             with open(config_file, "r", encoding="utf-8") as f:
                 user_config = json.load(f)
-            config = schema.deep_merge(config, user_config)
+            config = schema.deep_merge(dict(schema.DEFAULTS), user_config)
         except json.JSONDecodeError as e:
             output.error(f"Invalid JSON in {CONFIG_FILENAME}", str(e))
             raise SystemExit(1)
     
-    if profile in config.get("profiles", {}):
-        profile_overrides = config["profiles"][profile]
-        config = schema.deep_merge(config, profile_overrides)
+        if profile in config.get("profiles", {}):
+            profile_overrides = config["profiles"][profile]
+            config = schema.deep_merge(config, profile_overrides)
+        # Merging shares untouched subtrees with DEFAULTS; detach them
+        # before this config is filled in and mutated by the build
+        config = copy.deepcopy(config)
+    else:
+        config = schema.get_profile_defaults(profile)
     
     errors = schema.validate(config)
     if errors:
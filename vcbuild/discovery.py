@@ -1,22 +1,39 @@
 """Source and header file discovery."""
 
+import os
+import re
 import fnmatch
 from pathlib import Path
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
 
 from .config import Config
 
-@dataclass
+HEADER_EXTENSIONS = [".h", ".hh", ".hpp", ".hxx", ".inl", ".ipp"]
+
+@dataclass(slots=True)
 class SourceSet:
-    sources: list[Path]
+    sources: list[str]
     include_dirs: list[Path]
+    # st_mtime_ns and st_size per entry of sources (None if unreadable),
+    # taken from the discovery scan so incremental checks need no extra
+    # stat calls
+    mtimes: list[int | None] = field(default_factory=list)
+    sizes: list[int | None] = field(default_factory=list)
 
 def discover(config: Config) -> SourceSet:
     root = config.project_root
     sources_cfg = config.data.get("sources", {})
     
-    extensions = set(sources_cfg.get("extensions", [".cpp", ".cc", ".c", ".cxx"]))
-    exclude_patterns = sources_cfg.get("exclude_patterns", [])
+    extensions = tuple(
+        os.path.normcase(e)
+        for e in set(sources_cfg.get("extensions", [".cpp", ".cc", ".c", ".cxx"]))
+    )
+    # Same semantics as fnmatch.fnmatch, compiled once instead of per call
+    exclude_patterns = [
+        re.compile(fnmatch.translate(os.path.normcase(p)))
+        for p in sources_cfg.get("exclude_patterns", [])
+    ]
     
     source_dirs = [
         root / d for d in sources_cfg.get("source_dirs", ["src"])
@@ -37,32 +54,81 @@ def discover(config: Config) -> SourceSet:
     explicit = sources_cfg.get("explicit_sources", [])
     if explicit:
         sources = [
-            Path(s) if Path(s).is_absolute() else root / s
+            os.path.normpath(os.path.join(root, s))
             for s in explicit
         ]
-        return SourceSet(sources=sources, include_dirs=include_dirs)
+        stats = [_stat(s) for s in sources]
+        return SourceSet(sources=sources, include_dirs=include_dirs,
+                         mtimes=[m for m, _ in stats],
+                         sizes=[n for _, n in stats])
     
-    sources = []
-    for src_dir in source_dirs:
-        if not src_dir.exists():
-            continue
-        for ext in extensions:
-            for path in src_dir.rglob(f"*{ext}"):
-                if not _is_excluded(path, exclude_patterns):
-                    sources.append(path)
+    dirs = [str(d) for d in source_dirs]
+    if len(dirs) > 1 and sources_cfg.get("parallel_discovery", True):
+        # scandir releases the GIL, so separate roots are read concurrently
+        workers = min(len(dirs), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            walked = list(ex.map(lambda d: _walk(d, extensions), dirs))
+    else:
+        walked = [_walk(d, extensions) for d in dirs]
+
+    found = []
+    for entries in walked:
+        for entry in entries:
+            if not _is_excluded(entry.name, entry.path, exclude_patterns):
+                try:
+                    # Served from the directory listing on Windows
+                    st = entry.stat()
+                    found.append((entry.path, st.st_mtime_ns, st.st_size))
+                except OSError:
+                    found.append((entry.path, None, None))
+    found.sort()
     
     include_dirs = [d for d in include_dirs if d.exists()]
     
-    return SourceSet(sources=sorted(sources), include_dirs=include_dirs)
+    return SourceSet(sources=[p for p, _, _ in found], include_dirs=include_dirs,
+                     mtimes=[m for _, m, _ in found],
+                     sizes=[n for _, _, n in found])
+
+def _walk(top: str, extensions: tuple[str, ...]) -> list[os.DirEntry]:
+    """Collect files under top whose names end with one of extensions.
+
+    One os.scandir pass per directory covers every extension at once.
+    Extensions must already be normcased; like Path.rglob, symlinked
+    directories are not descended into and missing roots yield nothing.
+    """
+    found = []
+    stack = [top]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif os.path.normcase(entry.name).endswith(extensions):
+                    found.append(entry)
+    return found
+
+def _stat(path: str) -> tuple[int | None, int | None]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None, None
+    return st.st_mtime_ns, st.st_size
+
+def _is_excluded(name: str, path: str, patterns: list[re.Pattern]) -> bool:
+    if not patterns:
+        return False
 
-def _is_excluded(path: Path, patterns: list[str]) -> bool:
-    name = path.name
-    rel_path = str(path)
+    name = os.path.normcase(name)
+    rel_path = os.path.normcase(path)
     
     for pattern in patterns:
-        if fnmatch.fnmatch(name, pattern):
+        if pattern.match(name):
             return True
-        if fnmatch.fnmatch(rel_path, pattern):
+        if pattern.match(rel_path):
             return True
     
     return False
@@ -0,0 +1,29 @@
+"""JSON encoding with optional orjson acceleration."""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps(data: Any) -> bytes:
+    """Serialize to compact UTF-8 JSON with sorted keys."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+    # Same bytes as orjson, so digests survive installing or removing it
+    return json.dumps(data, sort_keys=True, separators=(",", ":"),
+                      ensure_ascii=False).encode()
+
+def dumps_pretty(data: Any) -> str:
+    """Serialize to indented JSON for display, preserving key order."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(data, indent=2)
+
+def loads(raw: bytes) -> Any:
+    """Parse UTF-8 JSON. Raises ValueError on malformed input."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
@@ -1,11 +1,21 @@
 """Terminal output formatting with clean, readable colors."""
 
 import sys
+import itertools
 import shutil
+import time
+import functools
 from dataclasses import dataclass
 from enum import Enum
 from typing import TextIO
 
+__all__ = [
+    "Color", "Theme", "init",
+    "error", "warning", "success", "info", "detail", "step",
+    "header", "build_header", "build_summary", "table",
+    "Progress", "Spinner",
+]
+
 class Color(Enum):
     RESET = "\033[0m"
     BOLD = "\033[1m"
@@ -32,49 +42,94 @@ class Theme:
 _theme = Theme()
 _color_enabled = True
 
+# Escape code per color, read without going through Enum.value
+_CODES = {color: color.value for color in Color}
+_RESET = Color.RESET.value
+
+# stderr labels, rebuilt by init() whenever color support is (re)detected
+_ERR_PREFIX = "error: "
+_WARN_PREFIX = "warning: "
+
+# Terminal width and the rules drawn from it, measured on first use and
+# reset by init()
+_TERM_COLS: int | None = None
+_RULES: dict[tuple[str, int], str] = {}
+
 def _supports_color() -> bool:
-    if not hasattr(sys.stdout, "isatty"):
-        return False
-    if not sys.stdout.isatty():
+    isatty = getattr(sys.stdout, "isatty", None)
+    if isatty is None or not isatty():
         return False
     if sys.platform == "win32":
-        try:
-            import ctypes
-            kernel32 = ctypes.windll.kernel32
-            kernel32.SetConsoleMode(kernel32.GetStdHandle(-11), 7)
-            return True
-        except Exception:
-            return False
+        return _enable_vt_mode()
     return True
 
+@functools.lru_cache(maxsize=1)
+def _enable_vt_mode() -> bool:
+    """Enable ANSI sequences on the Windows console, once per process.
+
+    ctypes is only loaded here, so piped runs never pay for it.
+    """
+    try:
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        kernel32.SetConsoleMode(kernel32.GetStdHandle(-11), 7)
+        return True
+    except Exception:
+        return False
+
 def init():
-    global _color_enabled
+    global _color_enabled, _ERR_PREFIX, _WARN_PREFIX, _TERM_COLS
+    global _c, _bold, _dim
     _color_enabled = _supports_color()
+    _TERM_COLS = None
+    _RULES.clear()
+
+    # Bind the styling helpers once instead of testing the flag per call
+    if _color_enabled:
+        _c, _bold, _dim = _c_color, _bold_color, _dim_color
+    else:
+        _c, _bold, _dim = _c_plain, _plain, _plain
+    _ERR_PREFIX = _c(_theme.error, "error") + ": "
+    _WARN_PREFIX = _c(_theme.warning, "warning") + ": "
+
+def _c_color(color: Color, text: str) -> str:
+    return _CODES[color] + text + _RESET
+
+def _bold_color(text: str) -> str:
+    return "\033[1m" + text + _RESET
+
+def _dim_color(text: str) -> str:
+    return "\033[2m" + text + _RESET
+
+def _c_plain(color: Color, text: str) -> str:
+    return text
+
+def _plain(text: str) -> str:
+    return text
 
-def _c(color: Color, text: str) -> str:
-    if not _color_enabled:
-        return text
-    return f"{color.value}{text}{Color.RESET.value}"
+_c, _bold, _dim = _c_color, _bold_color, _dim_color
 
-def _bold(text: str) -> str:
-    if not _color_enabled:
-        return text
-    return f"{Color.BOLD.value}{text}{Color.RESET.value}"
+def _term_cols() -> int:
+    global _TERM_COLS
+    if _TERM_COLS is None:
+        _TERM_COLS = shutil.get_terminal_size().columns
+    return _TERM_COLS
 
-def _dim(text: str) -> str:
-    if not _color_enabled:
-        return text
-    return f"{Color.DIM.value}{text}{Color.RESET.value}"
+def _rule(char: str, limit: int) -> str:
+    """Colored horizontal line as wide as the terminal, capped at limit."""
+    rule = _RULES.get((char, limit))
+    if rule is None:
+        rule = _RULES[char, limit] = _c(_theme.detail, char * min(_term_cols(), limit))
+    return rule
 
 def error(msg: str, detail: str = ""):
-    prefix = _c(_theme.error, "error")
-    print(f"{prefix}: {msg}", file=sys.stderr)
     if detail:
-        print(f"       {_c(_theme.detail, detail)}", file=sys.stderr)
+        sys.stderr.write(f"{_ERR_PREFIX}{msg}\n       {_c(_theme.detail, detail)}\n")
+    else:
+        sys.stderr.write(f"{_ERR_PREFIX}{msg}\n")
 
 def warning(msg: str):
-    prefix = _c(_theme.warning, "warning")
-    print(f"{prefix}: {msg}", file=sys.stderr)
+    sys.stderr.write(f"{_WARN_PREFIX}{msg}\n")
 
 def success(msg: str):
     print(_c(_theme.success, msg))
@@ -89,39 +144,25 @@ def step(msg: str):
     print(f"{_c(_theme.highlight, '>')} {msg}")
 
 def header(title: str):
-    width = min(shutil.get_terminal_size().columns, 60)
-    line = _c(_theme.detail, "-" * width)
-    print(f"\n{line}")
-    print(_bold(title))
-    print(f"{line}\n")
+    line = _rule("-", 60)
+    sys.stdout.write(f"\n{line}\n{_bold(title)}\n{line}\n\n")
 
 def build_header(name: str, profile: str, arch: str, proj_type: str):
     """Print a professional build header with project info."""
-    width = min(shutil.get_terminal_size().columns, 64)
-    bar = _c(_theme.detail, "=" * width)
-    print(f"\n{bar}")
-    print(f"  {_bold(name)}")
-    labels = []
-    labels.append(f"{profile}")
-    labels.append(f"{arch}")
-    labels.append(f"{proj_type}")
-    print(f"  {_c(_theme.detail, ' | '.join(labels))}")
-    print(bar)
+    bar = _rule("=", 64)
+    labels = _c(_theme.detail, f"{profile} | {arch} | {proj_type}")
+    sys.stdout.write(f"\n{bar}\n  {_bold(name)}\n  {labels}\n{bar}\n")
 
 def build_summary(success: bool, duration: float, files: int,
                   warnings: int, errors: int, output_path: str = ""):
     """Print build result summary."""
-    width = min(shutil.get_terminal_size().columns, 64)
-    bar = _c(_theme.detail, "-" * width)
-    print(f"\n{bar}")
+    bar = _rule("-", 64)
 
     if success:
         status = _c(_theme.success, "BUILD SUCCEEDED")
     else:
         status = _c(_theme.error, "BUILD FAILED")
 
-    print(f"  {status}")
-
     parts = []
     parts.append(f"{files} file(s)")
     if warnings > 0:
@@ -130,22 +171,21 @@ def build_summary(success: bool, duration: float, files: int,
         parts.append(_c(_theme.error, f"{errors} error(s)"))
     parts.append(f"{_format_duration(duration)}")
 
-    print(f"  {_c(_theme.detail, ' | '.join(parts))}")
-
+    lines = ["", bar, f"  {status}", f"  {_c(_theme.detail, ' | '.join(parts))}"]
     if success and output_path:
-        print(f"  {_c(_theme.detail, '->')} {output_path}")
-
-    print(bar)
+        lines.append(f"  {_c(_theme.detail, '->')} {output_path}")
+    lines.append(bar)
+    sys.stdout.write("\n".join(lines) + "\n")
 
 def _format_duration(seconds: float) -> str:
     if seconds < 1.0:
-        return f"{seconds*1000:.0f}ms"
+        return "%.0fms" % (seconds * 1000)
     elif seconds < 60.0:
-        return f"{seconds:.1f}s"
+        return "%.1fs" % seconds
     else:
         m = int(seconds // 60)
         s = seconds % 60
-        return f"{m}m {s:.1f}s"
+        return "%dm %.1fs" % (m, s)
 
 
 class Progress:
@@ -155,9 +195,30 @@ class Progress:
         self.desc = desc
         self.width = width
         self._last_line_len = 0
+        # Re-read every 64 updates so resizes are still picked up
+        self._term_width = shutil.get_terminal_size().columns
+        self._ticks = 0
+        self._last_filled = -1
+        self._last_status = ""
+        self._last_render = 0.0
+        # Invariant pieces of every frame
+        self._prefix = f"\r  {desc} [" if desc else "\r  ["
+        self._reset = Color.RESET.value if _color_enabled else ""
+        self._fill_color = _theme.success.value if _color_enabled else ""
+        self._detail_color = _theme.detail.value if _color_enabled else ""
+        self._hashes = "#" * width
+        self._dots = "." * width
+        # Piped output (CI logs, tee) gets no animation, only finish()'s line
+        isatty = getattr(sys.stdout, "isatty", None)
+        self._interactive = bool(isatty and isatty())
 
     def update(self, n: int = 1, status: str = ""):
         self.current = min(self.current + n, self.total)
+        if not self._interactive:
+            return
+        self._ticks += 1
+        if not self._ticks & 63:
+            self._term_width = shutil.get_terminal_size().columns
         self._render(status)
 
     def _render(self, status: str = ""):
@@ -168,37 +229,55 @@ class Progress:
             pct = int(100 * self.current / self.total)
             filled = int(self.width * self.current / self.total)
 
-        bar_char = "#"
-        empty_char = "."
-        bar_fill = _c(_theme.success, bar_char * filled)
-        bar_empty = _c(_theme.detail, empty_char * (self.width - filled))
-        bar = f"[{bar_fill}{bar_empty}]"
+        # Redraw only when the bar or status visibly changes, at most every
+        # 50ms otherwise; the final frame is always drawn
+        now = time.monotonic()
+        if (filled == self._last_filled and status == self._last_status
+                and now - self._last_render < 0.05
+                and self.current < self.total):
+            return
+        self._last_filled = filled
+        self._last_status = status
+        self._last_render = now
 
-        pct_str = f"{pct:3d}%"
+        reset = self._reset
+        detail_color = self._detail_color
+        pct_str = f"{pct:3d}% "
         count = f"{self.current}/{self.total}"
-
-        if self.desc:
-            line = f"\r  {self.desc} {bar} {pct_str} {_c(_theme.detail, count)}"
-        else:
-            line = f"\r  {bar} {pct_str} {_c(_theme.detail, count)}"
+        line = "".join((
+            self._prefix,
+            self._fill_color, self._hashes[:filled], reset,
+            detail_color, self._dots[filled:], reset,
+            "] ", pct_str,
+            detail_color, count, reset,
+        ))
+        # Every escape code here is one we inserted, so the visible width
+        # follows from the pieces without scanning the line for them
+        visible = len(self._prefix) + self.width + 2 + len(pct_str) + len(count)
 
         if status:
             # Truncate status to fit terminal
-            term_width = shutil.get_terminal_size().columns
-            max_status = max(10, term_width - len(line) + _ansi_len_diff(line) - 2)
+            max_status = max(10, self._term_width - visible - 2)
             if len(status) > max_status:
                 status = status[:max_status - 3] + "..."
-            line += f" {_c(_theme.detail, status)}"
+            line = "".join((line, " ", detail_color, status, reset))
+            visible += 1 + len(status)
 
-        padding = max(0, self._last_line_len - _visible_len(line))
-        sys.stdout.write(line + " " * padding)
+        padding = max(0, self._last_line_len - visible)
+        line += " " * padding
+        sys.stdout.write(line)
         sys.stdout.flush()
-        self._last_line_len = _visible_len(line)
+        self._last_line_len = visible
 
     def finish(self, msg: str = ""):
         self.current = self.total
-        self._render()
-        print()
+        if self._interactive:
+            self._render()
+            print()
+        elif self.desc:
+            print(f"  {self.desc} {self.current}/{self.total}")
+        else:
+            print(f"  {self.current}/{self.total}")
         if msg:
             success(msg)
 
@@ -210,6 +289,8 @@ class Spinner:
         self.msg = msg
         self.frame = 0
         self._active = False
+        self._frames = [f"\r  {msg}{_c(_theme.detail, f)}" for f in self.FRAMES]
+        self._clear_str = "\r" + " " * (len(msg) + 6) + "\r"
 
     def __enter__(self):
         self._active = True
@@ -227,12 +308,11 @@ class Spinner:
         self._render()
 
     def _render(self):
-        frame = _c(_theme.detail, self.FRAMES[self.frame])
-        sys.stdout.write(f"\r  {self.msg}{frame}")
+        sys.stdout.write(self._frames[self.frame])
         sys.stdout.flush()
 
     def _clear(self):
-        sys.stdout.write("\r" + " " * (len(self.msg) + 6) + "\r")
+        sys.stdout.write(self._clear_str)
         sys.stdout.flush()
 
 
@@ -240,37 +320,28 @@ def table(headers: list[str], rows: list[list[str]]):
     if not rows:
         return
 
-    widths = [len(h) for h in headers]
-    for row in rows:
-        for i, cell in enumerate(row):
-            if i < len(widths):
-                widths[i] = max(widths[i], len(cell))
+    # Transpose once (ragged rows padded) and size each header's column
+    columns = list(itertools.zip_longest(*rows, fillvalue=""))[:len(headers)]
+    columns += [()] * (len(headers) - len(columns))
+    widths = [max(len(h), max(map(len, col), default=0))
+              for h, col in zip(headers, columns)]
 
     header_line = "  ".join(
         _bold(h.ljust(widths[i])) for i, h in enumerate(headers)
     )
-    print(f"  {header_line}")
-    print(f"  {_c(_theme.detail, '-' * (sum(widths) + 2 * (len(widths) - 1)))}")
+    lines = [
+        f"  {header_line}",
+        f"  {_c(_theme.detail, '-' * (sum(widths) + 2 * (len(widths) - 1)))}",
+    ]
 
     for row in rows:
         cells = []
         for i, cell in enumerate(row):
             w = widths[i] if i < len(widths) else 0
             cells.append(cell.ljust(w))
-        print(f"  {'  '.join(cells)}")
-
+        lines.append(f"  {'  '.join(cells)}")
 
-def _ansi_len_diff(text: str) -> int:
-    """Return the difference between string length and visible length (ANSI codes)."""
-    import re
-    ansi_re = re.compile(r'\033\[[0-9;]*m')
-    stripped = ansi_re.sub('', text)
-    return len(text) - len(stripped)
+    sys.stdout.write("\n".join(lines) + "\n")
 
-def _visible_len(text: str) -> int:
-    """Return the visible length of text (excluding ANSI codes)."""
-    import re
-    ansi_re = re.compile(r'\033\[[0-9;]*m')
-    return len(ansi_re.sub('', text))
 
 init()
@@ -1,8 +1,14 @@
 """Configuration schema and defaults."""
 
-from typing import Any
+import copy
+from types import MappingProxyType
+from typing import Any, Mapping
 
-DEFAULTS: dict[str, Any] = {
+__all__ = ["DEFAULTS", "VALID_VALUES", "validate", "deep_merge",
+           "get_profile_defaults"]
+
+# Read-only at the top level; load() works on private deep copies
+DEFAULTS: Mapping[str, Any] = MappingProxyType({
     "project": {
         "name": None,
         "type": "exe",
@@ -65,7 +71,8 @@ DEFAULTS: dict[str, Any] = {
         "extensions": [".cpp", ".cc", ".c", ".cxx"],
         "exclude_patterns": [],
         "explicit_sources": [],
-        "external_dirs": []
+        "external_dirs": [],
+        "parallel_discovery": True
     },
     "profiles": {
         "debug": {
@@ -106,7 +113,7 @@ DEFAULTS: dict[str, Any] = {
         "target_os": "win10",
         "minifilter": False
     }
-}
+})
 
 VALID_VALUES = {
     "project.type": ["exe", "dll", "lib", "sys"],
@@ -127,19 +134,36 @@ VALID_VALUES = {
     "driver.target_os": ["win7", "win8", "win81", "win10", "win11"]
 }
 
+# VALID_VALUES grouped by top-level section, so validate() looks each
+# section up once: {section: [(key, remaining path, allowed set, valid list)]}
+# The list is kept for error messages
+_VALID_BY_SECTION: dict[str, list[tuple[str, tuple[str, ...], frozenset, list]]] = {}
+for _key, _valid in VALID_VALUES.items():
+    _section, *_rest = _key.split(".")
+    _VALID_BY_SECTION.setdefault(_section, []).append(
+        (_key, tuple(_rest), frozenset(_valid), _valid))
+
+_MISSING = object()
+
 def validate(config: dict, path: str = "") -> list[str]:
     errors = []
 
-    for key, valid in VALID_VALUES.items():
-        parts = key.split(".")
-        val = config
-        try:
-            for p in parts:
-                val = val[p]
-            if val not in valid:
+    for section, checks in _VALID_BY_SECTION.items():
+        sub = config.get(section, _MISSING)
+        if not isinstance(sub, dict):
+            continue
+        for key, rest, allowed, valid in checks:
+            val = sub
+            for p in rest:
+                val = val.get(p, _MISSING) if isinstance(val, dict) else _MISSING
+            if val is _MISSING:
+                continue
+            try:
+                ok = val in allowed
+            except TypeError:  # lists/dicts are never valid choices
+                ok = False
+            if not ok:
                 errors.append(f"{key}: invalid value '{val}', expected one of {valid}")
-        except (KeyError, TypeError):
-            pass
 
     warn_level = config.get("compiler", {}).get("warnings", {}).get("level")
     if warn_level is not None:
@@ -163,10 +187,25 @@ def validate(config: dict, path: str = "") -> list[str]:
     return errors
 
 def deep_merge(base: dict, override: dict) -> dict:
-    result = base.copy()
+    # Like untouched siblings below, an empty override shares base as-is
+    if not override:
+        return base
+    result = dict(base)
     for key, value in override.items():
-        if key in result and isinstance(result[key], dict) and isinstance(value, dict):
-            result[key] = deep_merge(result[key], value)
+        current = result.get(key)
+        if isinstance(current, dict) and isinstance(value, dict):
+            result[key] = deep_merge(current, value)
         else:
             result[key] = value
     return result
+
+# DEFAULTS with each built-in profile already applied, for projects
+# without a vcbuild.json
+_MERGED_PROFILES = {
+    name: deep_merge(dict(DEFAULTS), overrides)
+    for name, overrides in DEFAULTS["profiles"].items()
+}
+
+def get_profile_defaults(name: str) -> dict[str, Any]:
+    """Return a private copy of DEFAULTS with profile name applied."""
+    return copy.deepcopy(_MERGED_PROFILES.get(name) or dict(DEFAULTS))